@@ -1,6 +1,6 @@
 # predict.py
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
 import joblib
 import pandas as pd
@@ -37,6 +37,12 @@ class InputFeatures(BaseModel):
     BVP_std: float
     ACC_mag_mean: float
     ACC_mag_std: float
+    # HRV from IBI.csv; optional because some sessions have no beats (missing values are fine for XGBoost)
+    IBI_count: Optional[float] = None
+    IBI_mean: Optional[float] = None
+    HRV_sdnn: Optional[float] = None
+    HRV_rmssd: Optional[float] = None
+    HRV_pnn50: Optional[float] = None
 
 
 # ---------- Create FastAPI app ----------
@@ -0,0 +1,431 @@
+# src/data/aggregates.py
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+CHANNELS = ["EDA", "TEMP", "HR", "BVP", "ACC_mag"]
+LEVELS_S = (1, 10, 60)
+STATS = ("count", "mean", "m2", "min", "max")
+
+
+def load_clean_session(path: Path, compact: bool = False) -> pd.DataFrame:
+    """
+    Load one cleaned 4 Hz session written by clean_signals.
+
+    In compact mode signals are float32 and the timestamp column is dropped:
+    the grid is regular, so `attrs["start_time"]` and `attrs["sample_rate_hz"]`
+    are enough to recover any sample time.
+    """
+    if not path.exists():
+        raise FileNotFoundError(f"Could not find cleaned session at: {path}")
+    if not compact:
+        return pd.read_csv(path)
+
+    head = pd.read_csv(path, usecols=["timestamp"], nrows=2)["timestamp"].to_numpy(dtype=float)
+    columns = pd.read_csv(path, nrows=0).columns
+    signal_cols = [c for c in columns if c != "timestamp"]
+    df = pd.read_csv(path, usecols=signal_cols, dtype={c: np.float32 for c in signal_cols})
+    df.attrs = {"start_time": float(head[0]), "sample_rate_hz": 1.0 / float(head[1] - head[0])}
+    return df
+
+
+def session_times(df: pd.DataFrame) -> np.ndarray:
+    """Sample times of a clean session in either mode."""
+    if "timestamp" in df.columns:
+        return df["timestamp"].to_numpy(dtype=float)
+    return df.attrs["start_time"] + np.arange(len(df)) / df.attrs["sample_rate_hz"]
+
+
+def _channel(frame: pd.DataFrame, ch: str) -> np.ndarray:
+    """Channel values in their stored dtype; channels the session lacks are all-NaN."""
+    if ch in frame.columns:
+        return frame[ch].to_numpy()
+    return np.full(len(frame), np.nan)
+
+
+def _empty_stats() -> Dict[str, float]:
+    return {"count": 0.0, "mean": np.nan, "m2": 0.0, "min": np.nan, "max": np.nan}
+
+
+def _merge(acc: Dict[str, float], other: Dict[str, float]) -> Dict[str, float]:
+    """
+    Combine two partial aggregates.
+
+    count/mean/m2 (sum of squared deviations from the mean) are merged with
+    Chan et al.'s parallel formula, which stays accurate when the mean is
+    large compared to the spread (e.g. ACC_mag ~ 60 with std ~ 1e-14).
+    """
+    if other["count"] == 0:
+        return acc
+    if acc["count"] == 0:
+        return other
+    n = acc["count"] + other["count"]
+    delta = other["mean"] - acc["mean"]
+    return {
+        "count": n,
+        "mean": acc["mean"] + delta * other["count"] / n,
+        "m2": acc["m2"] + other["m2"] + delta ** 2 * acc["count"] * other["count"] / n,
+        "min": float(np.fmin(acc["min"], other["min"])),
+        "max": float(np.fmax(acc["max"], other["max"])),
+    }
+
+
+def _combine(count: np.ndarray, mean: np.ndarray, m2: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> Dict[str, float]:
+    """Merge any number of block aggregates at once (two-pass over the block means)."""
+    used = count > 0
+    n = float(count[used].sum())
+    if n == 0:
+        return _empty_stats()
+    total_mean = float(np.dot(count[used], mean[used]) / n)
+    spread = np.dot(count[used], (mean[used] - total_mean) ** 2)
+    return {
+        "count": n,
+        "mean": total_mean,
+        "m2": float(m2[used].sum() + spread),
+        "min": float(np.fmin.reduce(mins[used])),
+        "max": float(np.fmax.reduce(maxs[used])),
+    }
+
+
+def _block_means(count: np.ndarray, total: np.ndarray, segment: np.ndarray):
+    """Mean of every block (NaN if empty) and that mean broadcast back to the block's elements."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    return mean, np.nan_to_num(mean[segment])
+
+
+def build_level(frame: pd.DataFrame, block_s: int, origin: float) -> pd.DataFrame:
+    """
+    Aggregate a cleaned 4 Hz session frame into fixed blocks of `block_s` seconds.
+
+    Returns one row per non-empty block, indexed by block start time, with
+    `<channel>_{count,mean,m2,min,max}` columns for every channel, where m2 is
+    the sum of squared deviations from the block mean. Everything is
+    accumulated in float64 even when the frame is stored as float32.
+    """
+    block = np.floor((session_times(frame) - origin) / block_s)
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(block)) + 1])
+    segment = np.repeat(np.arange(len(bounds)), np.diff(np.append(bounds, len(block))))
+
+    out = {}
+    for ch in CHANNELS:
+        values = _channel(frame, ch)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0).astype(np.float64)
+        count = np.add.reduceat(valid.astype(np.float64), bounds)
+        mean, sample_mean = _block_means(count, np.add.reduceat(filled, bounds), segment)
+        out[f"{ch}_count"] = count
+        out[f"{ch}_mean"] = mean
+        out[f"{ch}_m2"] = np.add.reduceat(np.where(valid, filled - sample_mean, 0) ** 2, bounds)
+        out[f"{ch}_min"] = np.fmin.reduceat(values, bounds).astype(np.float64)
+        out[f"{ch}_max"] = np.fmax.reduceat(values, bounds).astype(np.float64)
+
+    level = pd.DataFrame(out, index=origin + block[bounds] * block_s)
+    level.index.name = "block_start"
+    return level
+
+
+def coarsen_level(level: pd.DataFrame, block_s: int, origin: float) -> pd.DataFrame:
+    """Build a coarser level from a finer one without touching the raw samples."""
+    starts = level.index.to_numpy(dtype=float)
+    parent = origin + np.floor((starts - origin) / block_s) * block_s
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(parent)) + 1])
+    segment = np.repeat(np.arange(len(bounds)), np.diff(np.append(bounds, len(parent))))
+
+    out = {}
+    for ch in CHANNELS:
+        child_count = level[f"{ch}_count"].to_numpy(dtype=float)
+        child_mean = np.nan_to_num(level[f"{ch}_mean"].to_numpy(dtype=float))
+        count = np.add.reduceat(child_count, bounds)
+        mean, child_parent_mean = _block_means(count, np.add.reduceat(child_count * child_mean, bounds), segment)
+        spread = child_count * (child_mean - child_parent_mean) ** 2
+        out[f"{ch}_count"] = count
+        out[f"{ch}_mean"] = mean
+        out[f"{ch}_m2"] = np.add.reduceat(level[f"{ch}_m2"].to_numpy(dtype=float) + spread, bounds)
+        out[f"{ch}_min"] = np.fmin.reduceat(level[f"{ch}_min"].to_numpy(dtype=float), bounds)
+        out[f"{ch}_max"] = np.fmax.reduceat(level[f"{ch}_max"].to_numpy(dtype=float), bounds)
+
+    coarse = pd.DataFrame(out, index=parent[bounds])
+    coarse.index.name = "block_start"
+    return coarse
+
+
+def _merge_pairs(left: Dict[str, np.ndarray], right: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Vectorised `_merge` of two equally long arrays of aggregates."""
+    n = left["count"] + right["count"]
+    delta = right["mean"] - left["mean"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = np.where(n > 0, right["count"] / n, 0.0)
+        spread = np.where(n > 0, delta ** 2 * left["count"] * weight, 0.0)
+    return {
+        "count": n,
+        "mean": left["mean"] + delta * weight,
+        "m2": left["m2"] + right["m2"] + spread,
+        "min": np.fmin(left["min"], right["min"]),
+        "max": np.fmax(left["max"], right["max"]),
+    }
+
+
+class _SegmentTree:
+    """Merged aggregates over any range of top-level blocks in O(log n) nodes."""
+
+    def __init__(self, level: pd.DataFrame, channel: str):
+        n_blocks = len(level)
+        self.size = 1 << max(n_blocks - 1, 0).bit_length()
+        leaves = {
+            "count": np.zeros(self.size),
+            "mean": np.zeros(self.size),
+            "m2": np.zeros(self.size),
+            "min": np.full(self.size, np.nan),
+            "max": np.full(self.size, np.nan),
+        }
+        for stat in STATS:
+            leaves[stat][:n_blocks] = level[f"{channel}_{stat}"].to_numpy(dtype=float)
+        leaves["mean"] = np.nan_to_num(leaves["mean"])
+
+        # layers[0] are the leaves, layers[-1] the root.
+        self.layers = [leaves]
+        while len(self.layers[-1]["count"]) > 1:
+            prev = self.layers[-1]
+            self.layers.append(_merge_pairs({k: v[0::2] for k, v in prev.items()}, {k: v[1::2] for k, v in prev.items()}))
+
+    def query(self, lo: int, hi: int) -> Dict[str, float]:
+        nodes = []
+        depth = 0
+        while lo < hi:
+            if lo & 1:
+                nodes.append((depth, lo))
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                nodes.append((depth, hi))
+            lo >>= 1
+            hi >>= 1
+            depth += 1
+        return _combine(*(np.array([self.layers[d][stat][i] for d, i in nodes]) for stat in STATS))
+
+
+class SessionPyramid:
+    """
+    Multi-resolution aggregates (1 s / 10 s / 60 s) for one cleaned session.
+
+    Range queries are answered by covering the interior of [start, end) with
+    60 s blocks and only descending to 10 s, 1 s and raw samples at the edges,
+    so cost no longer grows with the length of the range.
+    """
+
+    def __init__(self, frame: pd.DataFrame, levels_s: Tuple[int, ...] = LEVELS_S):
+        if "timestamp" in frame.columns and not frame["timestamp"].is_monotonic_increasing:
+            frame = frame.sort_values("timestamp").reset_index(drop=True)
+        self.levels_s = tuple(sorted(levels_s))
+        self._raw_loader = None
+        self._set_raw(frame)
+        self.start_time = self._raw_start
+        self.end_time = float(np.nextafter(self._raw_end, np.inf))
+        self._set_origin()
+
+        self.levels: Dict[int, pd.DataFrame] = {}
+        finest = build_level(frame, self.levels_s[0], self.origin)
+        self.levels[self.levels_s[0]] = finest
+        for block_s in self.levels_s[1:]:
+            finest = coarsen_level(finest, block_s, self.origin)
+            self.levels[block_s] = finest
+
+        self._index()
+
+    @classmethod
+    def from_levels(cls, levels: Dict[int, pd.DataFrame], raw_loader: Callable[[], pd.DataFrame] = None) -> "SessionPyramid":
+        """
+        Rebuild a pyramid from saved levels.
+
+        `raw_loader` is only called the first time a query edge falls inside
+        a finest-level block; without it queries snap to whole finest blocks.
+        """
+        pyramid = cls.__new__(cls)
+        pyramid.levels_s = tuple(sorted(levels))
+        pyramid.levels = levels
+        pyramid._raw_loader = raw_loader
+        pyramid.raw = None
+        finest_s = pyramid.levels_s[0]
+        finest = levels[finest_s].index
+        pyramid.start_time = float(finest.min())
+        pyramid.end_time = float(finest.max()) + finest_s
+        pyramid._set_origin()
+        pyramid._index()
+        return pyramid
+
+    def _set_origin(self):
+        top = self.levels_s[-1]
+        self.origin = float(np.floor(self.start_time / top) * top)
+
+    def _set_raw(self, frame: pd.DataFrame):
+        """
+        Keep raw samples (in their stored dtype) for sub-second range edges.
+
+        Expects a frame sorted by timestamp. Compact frames have no timestamp
+        column, so sample positions are computed from the scalar start time
+        and sample rate instead.
+        """
+        if "timestamp" in frame.columns:
+            self.timestamps = frame["timestamp"].to_numpy(dtype=float)
+            self._raw_start = float(self.timestamps[0])
+            self._raw_end = float(self.timestamps[-1])
+        else:
+            self.timestamps = None
+            self.sample_rate_hz = float(frame.attrs["sample_rate_hz"])
+            self._raw_start = float(frame.attrs["start_time"])
+            self._raw_end = self._raw_start + (len(frame) - 1) / self.sample_rate_hz
+        self.raw = {ch: _channel(frame, ch) for ch in CHANNELS}
+
+    def _has_raw(self) -> bool:
+        """Load the raw frame on first use if the pyramid was restored from disk."""
+        if self.raw is None and self._raw_loader is not None:
+            frame = self._raw_loader()
+            if "timestamp" in frame.columns and not frame["timestamp"].is_monotonic_increasing:
+                frame = frame.sort_values("timestamp").reset_index(drop=True)
+            self._set_raw(frame)
+        return self.raw is not None
+
+    def _index(self):
+        """Block start times per level and a segment tree per channel for the top level."""
+        self._starts = {block_s: level.index.to_numpy(dtype=float) for block_s, level in self.levels.items()}
+        top = self.levels[self.levels_s[-1]]
+        self._trees = {ch: _SegmentTree(top, ch) for ch in CHANNELS}
+
+    def _blocks(self, block_s: int, channel: str, lo: int, hi: int) -> Dict[str, float]:
+        if lo >= hi:
+            return _empty_stats()
+        if block_s == self.levels_s[-1]:
+            return self._trees[channel].query(lo, hi)
+        # Edge levels only ever contribute a handful of blocks.
+        level = self.levels[block_s]
+        return _combine(*(level[f"{channel}_{stat}"].to_numpy(dtype=float)[lo:hi] for stat in STATS))
+
+    def _raw(self, channel: str, start: float, end: float) -> Dict[str, float]:
+        if self.timestamps is not None:
+            lo, hi = np.searchsorted(self.timestamps, [start, end], side="left")
+        else:
+            n = len(self.raw[channel])
+            lo, hi = np.clip(np.ceil((np.array([start, end]) - self._raw_start) * self.sample_rate_hz), 0, n).astype(int)
+        values = self.raw[channel][lo:hi].astype(np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return _empty_stats()
+        mean = values.mean()
+        return {
+            "count": float(len(values)),
+            "mean": float(mean),
+            "m2": float(np.square(values - mean).sum()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+        }
+
+    def _cover(self, channel: str, start: float, end: float, depth: int) -> Dict[str, float]:
+        if start >= end:
+            return _empty_stats()
+        if depth < 0:
+            if not self._has_raw():
+                return _empty_stats()
+            return self._raw(channel, start, end)
+
+        block_s = self.levels_s[depth]
+        first = self.origin + np.ceil((start - self.origin) / block_s) * block_s
+        last = self.origin + np.floor((end - self.origin) / block_s) * block_s
+        if first >= last:
+            return self._cover(channel, start, end, depth - 1)
+
+        starts = self._starts[block_s]
+        lo, hi = np.searchsorted(starts, [first, last], side="left")
+        stats = self._blocks(block_s, channel, int(lo), int(hi))
+        stats = _merge(stats, self._cover(channel, start, first, depth - 1))
+        stats = _merge(stats, self._cover(channel, last, end, depth - 1))
+        return stats
+
+    def aggregate(self, channel: str, start: float = None, end: float = None, exact: bool = True) -> Dict[str, float]:
+        """
+        Raw count/mean/m2/min/max of `channel` over timestamps in [start, end).
+
+        With `exact=False`, or when no raw frame is available, the range is
+        widened to whole finest-level (1 s) blocks so no raw samples are read.
+        """
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel: {channel}")
+        start = self.start_time if start is None else float(start)
+        end = self.end_time if end is None else float(end)
+        if not exact or (self.raw is None and self._raw_loader is None):
+            finest_s = self.levels_s[0]
+            start = self.origin + np.floor((start - self.origin) / finest_s) * finest_s
+            end = self.origin + np.ceil((end - self.origin) / finest_s) * finest_s
+        return self._cover(channel, start, end, len(self.levels_s) - 1)
+
+    def query(self, channel: str, start: float = None, end: float = None, exact: bool = True) -> Dict[str, float]:
+        """
+        Mean / std / min / max of `channel` over timestamps in [start, end).
+
+        std uses ddof=0 to match the session features in features_per_session.csv.
+        See `aggregate` for `exact`.
+        """
+        stats = self.aggregate(channel, start, end, exact)
+        n = stats["count"]
+        if n == 0:
+            return {"count": 0, "mean": np.nan, "std": np.nan, "min": np.nan, "max": np.nan}
+        return {
+            "count": int(n),
+            "mean": stats["mean"],
+            "std": float(np.sqrt(stats["m2"] / n)),
+            "min": stats["min"],
+            "max": stats["max"],
+        }
+
+    def session_features(self) -> Dict[str, float]:
+        """`<channel>_mean` / `<channel>_std` for the whole session, from the top level only."""
+        top = self.levels[self.levels_s[-1]]
+        features = {}
+        for ch in CHANNELS:
+            stats = _combine(*(top[f"{ch}_{stat}"].to_numpy(dtype=float) for stat in STATS))
+            n = stats["count"]
+            features[f"{ch}_mean"] = stats["mean"]
+            features[f"{ch}_std"] = float(np.sqrt(stats["m2"] / n)) if n else np.nan
+        return features
+
+    def window_features(self) -> pd.DataFrame:
+        """`<channel>_mean` / `<channel>_std` per top-level block, indexed by window_start."""
+        top = self.levels[self.levels_s[-1]]
+        out = {}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for ch in CHANNELS:
+                out[f"{ch}_mean"] = top[f"{ch}_mean"].to_numpy()
+                out[f"{ch}_std"] = np.sqrt(top[f"{ch}_m2"].to_numpy() / top[f"{ch}_count"].to_numpy())
+        return pd.DataFrame(out, index=top.index.rename("window_start"))
+
+
+def save_pyramid(pyramid: SessionPyramid, out_path: Path):
+    """Write all levels of a pyramid to one CSV with a `level_s` column."""
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    frames = [level.reset_index().assign(level_s=block_s) for block_s, level in pyramid.levels.items()]
+    df = pd.concat(frames, ignore_index=True)
+    df = df[["level_s", "block_start"] + [c for c in df.columns if c not in ("level_s", "block_start")]]
+    df.to_csv(out_path, index=False)
+
+
+def load_pyramid(pyramid_path: Path, clean_path: Path = None, compact: bool = False) -> SessionPyramid:
+    """
+    Load saved levels of one session.
+
+    `clean_path` is optional: the clean session is only read if a query needs
+    sub-second edges. Without it, queries snap to whole 1 s blocks.
+    """
+    if not pyramid_path.exists():
+        raise FileNotFoundError(f"Could not find aggregates file at: {pyramid_path}")
+    df = pd.read_csv(pyramid_path)
+    levels = {
+        int(block_s): group.drop(columns="level_s").set_index("block_start")
+        for block_s, group in df.groupby("level_s")
+    }
+    raw_loader = None
+    if clean_path is not None:
+        raw_loader = lambda: load_clean_session(clean_path, compact)
+    return SessionPyramid.from_levels(levels, raw_loader)
@@ -1,9 +1,14 @@
 # src/data/clean_signals.py
+import os
 from pathlib import Path
+import tempfile
 import numpy as np
 import pandas as pd
 import yaml
 
+from .. import profiling
+from . import hrv
+from .aggregates import LEVELS_S, SessionPyramid, save_pyramid
 from .empatica_loader import load_empatica
 
 TARGET_FS = 4.0  # Hz
@@ -15,140 +20,215 @@ def read_cfg():
         return yaml.safe_load(f)
 
 def _smooth_series(s: pd.Series, fs: float) -> pd.Series:
-    """Median then mean smoothing in native sampling rate."""
+    """Median then mean smoothing in native sampling rate (keeps the input dtype)."""
     med = int(max(1, ROLL_MED_SEC * fs))
     mean = int(max(1, ROLL_MEAN_SEC * fs))
     s1 = s.rolling(window=med, center=True, min_periods=1).median()
     s2 = s1.rolling(window=mean, center=True, min_periods=1).mean()
-    return s2
-
-def _resample_to_grid(df: pd.DataFrame, col: str, grid_ts: np.ndarray) -> pd.Series:
+    return s2.astype(s.dtype)
+
+def _sample_rate(df: pd.DataFrame) -> float:
+    if "sample_rate_hz" in df.attrs:
+        return float(df.attrs["sample_rate_hz"])
+    return float(df["sample_rate_hz"].iloc[0]) if "sample_rate_hz" in df else TARGET_FS
+
+def _time_span(df: pd.DataFrame) -> tuple:
+    """(first, last) sample time; compact frames derive it from start time and rate."""
+    if "timestamp" in df:
+        return df["timestamp"].min(), df["timestamp"].max()
+    start = df.attrs["start_time_utc"]
+    return start, start + (len(df) - 1) / df.attrs["sample_rate_hz"]
+
+def _sample_times(df: pd.DataFrame) -> np.ndarray:
+    if "timestamp" in df:
+        return df["timestamp"].to_numpy(dtype=float)
+    return df.attrs["start_time_utc"] + np.arange(len(df)) / df.attrs["sample_rate_hz"]
+
+def _resample_to_grid(df: pd.DataFrame, col: str, grid_ts: np.ndarray) -> np.ndarray:
     """
-    df: has 'timestamp' (float seconds) + value column 'col'
+    df: 'timestamp' column (float seconds) or compact attrs + value column 'col'
     grid_ts: numpy array of target timestamps (seconds)
-    returns: Series aligned to DatetimeIndex(grid_ts)
+    returns: values linearly interpolated onto grid_ts, in the dtype of 'col'.
+    Grid points before the first sample are NaN, points after the last one
+    repeat the last value.
     """
-    target_idx = pd.to_datetime(grid_ts, unit="s")
-    small = df[["timestamp", col]].dropna().sort_values("timestamp")
-    if small.empty:
-        return pd.Series(index=target_idx, dtype=float)
-
-    s = pd.Series(
-        small[col].to_numpy(),
-        index=pd.to_datetime(small["timestamp"].to_numpy(), unit="s"),
-    )
-    s = s.sort_index().reindex(s.index.union(target_idx)).interpolate(method="time")
-    s = s.reindex(target_idx)
-    return s
-
-def process_session(session_dir: Path) -> pd.DataFrame:
+    values = df[col].to_numpy()
+    ts = _sample_times(df)
+    keep = ~np.isnan(values) & ~np.isnan(ts)
+    if not keep.all():
+        values, ts = values[keep], ts[keep]
+    if len(values) == 0:
+        return np.full(len(grid_ts), np.nan, dtype=values.dtype)
+    if (np.diff(ts) < 0).any():
+        order = np.argsort(ts, kind="stable")
+        values, ts = values[order], ts[order]
+    out = np.interp(grid_ts, ts, values, left=np.nan)
+    return out.astype(values.dtype, copy=False)
+
+def process_session(session_dir: Path, compact: bool = False, profiler: profiling.Profiler = None) -> pd.DataFrame:
     """
     session_dir e.g. .../Wearable_Dataset/STRESS/S01
     Returns aligned 4 Hz dataframe with columns:
       timestamp, EDA, TEMP, HR, BVP, ACC_mag
+    compact=True loads and returns the signals as float32 (timestamp stays float64).
+    profiler times the load / smooth / resample stages.
     """
+    profiler = profiler or profiling.Profiler()
+
     # Load available signals
-    eda  = load_empatica(session_dir / "EDA.csv")  if (session_dir / "EDA.csv").exists()  else None
-    temp = load_empatica(session_dir / "TEMP.csv") if (session_dir / "TEMP.csv").exists() else None
-    hr   = load_empatica(session_dir / "HR.csv")   if (session_dir / "HR.csv").exists()   else None
-    bvp  = load_empatica(session_dir / "BVP.csv")  if (session_dir / "BVP.csv").exists()  else None
-    acc  = load_empatica(session_dir / "ACC.csv")  if (session_dir / "ACC.csv").exists()  else None
+    with profiler.stage("load"):
+        eda  = load_empatica(session_dir / "EDA.csv", compact)  if (session_dir / "EDA.csv").exists()  else None
+        temp = load_empatica(session_dir / "TEMP.csv", compact) if (session_dir / "TEMP.csv").exists() else None
+        hr   = load_empatica(session_dir / "HR.csv", compact)   if (session_dir / "HR.csv").exists()   else None
+        bvp  = load_empatica(session_dir / "BVP.csv", compact)  if (session_dir / "BVP.csv").exists()  else None
+        acc  = load_empatica(session_dir / "ACC.csv", compact)  if (session_dir / "ACC.csv").exists()  else None
 
     # Smooth in native rate
-    if eda is not None and "value" in eda:
-        fs = float(eda["sample_rate_hz"].iloc[0]) if "sample_rate_hz" in eda else TARGET_FS
-        eda["value"] = _smooth_series(eda["value"], fs).clip(lower=0, upper=60)
+    with profiler.stage("smooth"):
+        if eda is not None and "value" in eda:
+            eda["value"] = _smooth_series(eda["value"], _sample_rate(eda)).clip(lower=0, upper=60)
 
-    if temp is not None and "value" in temp:
-        fs = float(temp["sample_rate_hz"].iloc[0]) if "sample_rate_hz" in temp else TARGET_FS
-        temp["value"] = _smooth_series(temp["value"], fs)
+        if temp is not None and "value" in temp:
+            temp["value"] = _smooth_series(temp["value"], _sample_rate(temp))
 
-    if hr is not None and "value" in hr:
-        fs = float(hr["sample_rate_hz"].iloc[0]) if "sample_rate_hz" in hr else TARGET_FS
-        hr["value"] = _smooth_series(hr["value"], fs)
+        if hr is not None and "value" in hr:
+            hr["value"] = _smooth_series(hr["value"], _sample_rate(hr))
 
-    if bvp is not None and "value" in bvp:
-        fs = float(bvp["sample_rate_hz"].iloc[0]) if "sample_rate_hz" in bvp else TARGET_FS
-        bvp["value"] = _smooth_series(bvp["value"], fs)
+        if bvp is not None and "value" in bvp:
+            bvp["value"] = _smooth_series(bvp["value"], _sample_rate(bvp))
 
-    if acc is not None and {"x","y","z"}.issubset(acc.columns):
-        fs = float(acc["sample_rate_hz"].iloc[0]) if "sample_rate_hz" in acc else TARGET_FS
-        acc["mag"] = np.sqrt(acc["x"]**2 + acc["y"]**2 + acc["z"]**2)
-        acc["mag"] = _smooth_series(acc["mag"], fs)
+        if acc is not None and {"x","y","z"}.issubset(acc.columns):
+            acc["mag"] = np.sqrt(acc["x"]**2 + acc["y"]**2 + acc["z"]**2)
+            acc["mag"] = _smooth_series(acc["mag"], _sample_rate(acc))
 
     # Build common time window
     ts_min, ts_max = None, None
     for d in (eda, temp, hr, bvp, acc):
-        if d is None or "timestamp" not in d: 
+        if d is None or ("timestamp" not in d and "start_time_utc" not in d.attrs):
             continue
-        mn, mx = d["timestamp"].min(), d["timestamp"].max()
+        mn, mx = _time_span(d)
         ts_min = mn if ts_min is None else min(ts_min, mn)
         ts_max = mx if ts_max is None else max(ts_max, mx)
 
     if ts_min is None or ts_max is None or not np.isfinite([ts_min, ts_max]).all():
         return pd.DataFrame()  # nothing to align
 
-    # Common 4 Hz grid
-    grid = np.arange(ts_min, ts_max, 1.0 / TARGET_FS)
-    target_idx = pd.to_datetime(grid, unit="s")
-    res = pd.DataFrame({"timestamp": grid}, index=target_idx)
-
-    # Resample each signal to the grid
-    if eda is not None and "value" in eda:
-        res["EDA"] = _resample_to_grid(eda.rename(columns={"value": "EDA"}), "EDA", grid)
-    if temp is not None and "value" in temp:
-        res["TEMP"] = _resample_to_grid(temp.rename(columns={"value": "TEMP"}), "TEMP", grid)
-    if hr is not None and "value" in hr:
-        res["HR"] = _resample_to_grid(hr.rename(columns={"value": "HR"}), "HR", grid)
-    if bvp is not None and "value" in bvp:
-        res["BVP"] = _resample_to_grid(bvp.rename(columns={"value": "BVP"}), "BVP", grid)
-    if acc is not None and "mag" in acc:
-        res["ACC_mag"] = _resample_to_grid(acc.rename(columns={"mag": "ACC_mag"}), "ACC_mag", grid)
-
-    # Return with timestamp column (index is only for alignment)
-    return res.reset_index(drop=True)
-
-def main():
+    with profiler.stage("resample"):
+        # Common 4 Hz grid, interpolated on float seconds
+        grid = np.arange(ts_min, ts_max, 1.0 / TARGET_FS)
+        res = pd.DataFrame({"timestamp": grid})
+
+        # Resample each signal to the grid
+        if eda is not None and "value" in eda:
+            res["EDA"] = _resample_to_grid(eda, "value", grid)
+        if temp is not None and "value" in temp:
+            res["TEMP"] = _resample_to_grid(temp, "value", grid)
+        if hr is not None and "value" in hr:
+            res["HR"] = _resample_to_grid(hr, "value", grid)
+        if bvp is not None and "value" in bvp:
+            res["BVP"] = _resample_to_grid(bvp, "value", grid)
+        if acc is not None and "mag" in acc:
+            res["ACC_mag"] = _resample_to_grid(acc, "mag", grid)
+
+    return res
+
+def clean_session(subj: Path, out_root: Path, pyramid_root: Path, compact: bool = False,
+                  profiler: profiling.Profiler = None):
+    """
+    Clean one raw session and write its 4 Hz CSV and aggregate pyramid.
+    Returns (frame, pyramid); both are None if the session has no usable data.
+    """
+    profiler = profiler or profiling.Profiler()
+    condition = subj.parent.name
+    df = process_session(subj, compact, profiler)
+    if df.empty:
+        return None, None
+
+    subj_out_dir = out_root / condition
+    subj_out_dir.mkdir(parents=True, exist_ok=True)
+    with profiler.stage("write_csv"):
+        df.to_csv(subj_out_dir / f"{subj.name}.csv", index=False)
+
+    # 1 s / 10 s / 60 s aggregates; session and window features come from the 60 s level
+    with profiler.stage("build_pyramid"):
+        pyramid = SessionPyramid(df)
+    with profiler.stage("write_pyramid"):
+        save_pyramid(pyramid, pyramid_root / condition / f"{subj.name}.csv")
+    return df, pyramid
+
+def compact_from_env() -> bool:
+    """Low-memory float32 mode, switched on with PIPELINE_COMPACT=1."""
+    return os.environ.get("PIPELINE_COMPACT", "").lower() in ("1", "true", "yes")
+
+def main(compact: bool = None):
+    if compact is None:
+        compact = compact_from_env()
     cfg = read_cfg()
     raw_root = Path(cfg["data"]["raw_dir"])
-    out_root = Path(cfg["data"]["processed_dir"]) / "clean"
+    processed_dir = Path(cfg["data"]["processed_dir"])
+    out_root = processed_dir / "clean"
     out_root.mkdir(parents=True, exist_ok=True)
+    pyramid_root = processed_dir / "aggregates"
 
+    profiler = profiling.from_env()
     records = []
+    windows = []
+    sessions = {}
+    session_starts = {}
     for condition in ["STRESS", "AEROBIC", "ANAEROBIC"]:
         cdir = raw_root / condition
         if not cdir.exists():
             continue
         for subj in sorted([d for d in cdir.iterdir() if d.is_dir()]):
+            name = f"{condition}_{subj.name}"
             try:
-                df = process_session(subj)
+                with profiler.session(name):
+                    df, pyramid = clean_session(subj, out_root, pyramid_root, compact, profiler)
             except Exception as e:
                 print(f"[WARN] Skipping {condition}/{subj.name}: {e}")
                 continue
 
-            if df.empty:
+            if df is None:
                 print(f"[INFO] No usable data in {condition}/{subj.name}, skipping.")
                 continue
 
-            subj_out_dir = out_root / condition
-            subj_out_dir.mkdir(parents=True, exist_ok=True)
-            outp = subj_out_dir / f"{subj.name}.csv"
-            df.to_csv(outp, index=False)
-
-            # quick features
+            sessions[name] = subj
+            session_starts[(condition, subj.name)] = float(df["timestamp"].iloc[0])
             feats = {"condition": condition, "subject": subj.name}
-            for col in ["EDA", "TEMP", "HR", "BVP", "ACC_mag"]:
-                if col in df.columns:
-                    vals = df[col].to_numpy(dtype=float)
-                    feats[f"{col}_mean"] = float(np.nanmean(vals))
-                    feats[f"{col}_std"]  = float(np.nanstd(vals))
+            feats.update(pyramid.session_features())
             records.append(feats)
-            print("Saved:", outp)
+            windows.append(pyramid.window_features().reset_index().assign(condition=condition, subject=subj.name))
+            print("Saved:", out_root / condition / f"{subj.name}.csv")
 
     if records:
-        feat_df = pd.DataFrame(records)
-        feat_df.to_csv(Path(cfg["data"]["processed_dir"]) / "features_per_session.csv", index=False)
-        print("Saved features:", Path(cfg["data"]["processed_dir"]) / "features_per_session.csv")
+        # HRV from IBI.csv of all sessions at once, per session and per 60 s window
+        keys = ["condition", "subject"]
+        with profiler.stage("hrv"):
+            ibi_paths = {(subj.parent.name, subj.name): subj / "IBI.csv" for subj in sessions.values()}
+            batch = hrv.load_ibi_batch(ibi_paths, session_starts)
+            hrv_sessions = hrv.hrv_per_session(batch)
+            hrv_windows = hrv.hrv_per_window(batch, window_s=LEVELS_S[-1])
+
+        feat_df = pd.DataFrame(records).merge(hrv_sessions, on=keys, how="left")
+        feat_df.to_csv(processed_dir / "features_per_session.csv", index=False)
+        print("Saved features:", processed_dir / "features_per_session.csv")
+
+        win_df = pd.concat(windows, ignore_index=True)
+        win_df = win_df[keys + [c for c in win_df.columns if c not in keys]]
+        overlap = hrv_windows.merge(win_df[keys + ["window_start"]], on=keys + ["window_start"], how="left", indicator=True)
+        overlaps = (overlap["_merge"] == "both").groupby([overlap["condition"], overlap["subject"]]).any()
+        for condition, subject in overlaps[~overlaps].index:
+            print(f"[WARN] {condition}/{subject}: HRV windows do not overlap any 60 s signal window")
+        win_df = win_df.merge(hrv_windows, on=keys + ["window_start"], how="left")
+        win_df.to_csv(processed_dir / "features_per_window.csv", index=False)
+        print("Saved window features:", processed_dir / "features_per_window.csv")
+
+    # cProfile re-runs write into a scratch directory so the outputs above stay as they are
+    with tempfile.TemporaryDirectory() as tmp:
+        profiler.profile_slowest(
+            lambda name: clean_session(sessions[name], Path(tmp) / "clean", Path(tmp) / "aggregates", compact)
+        )
+    profiler.write_report("clean_signals")
 
 if __name__ == "__main__":
     main()
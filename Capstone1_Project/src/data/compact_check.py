@@ -0,0 +1,100 @@
+# src/data/compact_check.py
+from pathlib import Path
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import SessionPyramid
+from .clean_signals import process_session, read_cfg
+
+
+def _peak_memory(fn):
+    """Result of fn() and the peak traced allocation (bytes) while it ran."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def compare_modes(session_dir: Path, rtol: float = 1e-4) -> dict:
+    """
+    Run process_session on one raw session in float64 and in compact mode.
+
+    Returns the peak traced memory of both runs, the size of the resulting
+    frames, the largest difference on the 4 Hz grid (relative to each
+    channel's largest magnitude) and the largest relative difference between
+    the session features computed from the two frames.
+    """
+    full, full_peak = _peak_memory(lambda: process_session(session_dir))
+    small, small_peak = _peak_memory(lambda: process_session(session_dir, compact=True))
+    if full.empty:
+        return {}
+    if not np.array_equal(full["timestamp"].to_numpy(), small["timestamp"].to_numpy()):
+        raise ValueError(f"Compact mode changed the 4 Hz grid of {session_dir}")
+
+    max_grid_diff = 0.0
+    for col in full.columns.drop("timestamp"):
+        expected = full[col].to_numpy()
+        scale = max(np.nanmax(np.abs(expected), initial=0.0), 1e-12)
+        diff = np.abs(small[col].to_numpy(dtype=float) - expected)
+        if not np.array_equal(np.isnan(diff), np.isnan(expected)):
+            raise ValueError(f"Compact mode changed the missing samples of {col} in {session_dir}")
+        max_grid_diff = max(max_grid_diff, np.nanmax(diff, initial=0.0) / scale)
+
+    full_feats = SessionPyramid(full).session_features()
+    small_feats = SessionPyramid(small).session_features()
+    max_feature_diff = 0.0
+    for name, expected in full_feats.items():
+        if np.isnan(expected):
+            continue
+        max_feature_diff = max(max_feature_diff, abs(small_feats[name] - expected) / max(abs(expected), 1e-12))
+
+    return {
+        "peak_mb_float64": full_peak / 1e6,
+        "peak_mb_compact": small_peak / 1e6,
+        "frame_mb_float64": full.memory_usage(deep=True).sum() / 1e6,
+        "frame_mb_compact": small.memory_usage(deep=True).sum() / 1e6,
+        "max_grid_diff": max_grid_diff,
+        "max_feature_diff": max_feature_diff,
+        "within_tolerance": max(max_grid_diff, max_feature_diff) <= rtol,
+    }
+
+
+def main():
+    cfg = read_cfg()
+    raw_root = Path(cfg["data"]["raw_dir"])
+    session_dirs = [
+        subj
+        for condition in ["STRESS", "AEROBIC", "ANAEROBIC"]
+        if (raw_root / condition).exists()
+        for subj in sorted(d for d in (raw_root / condition).iterdir() if d.is_dir())
+    ]
+    if not session_dirs:
+        raise FileNotFoundError(f"No raw sessions found under: {raw_root}")
+
+    print(f"Running process_session in float64 and compact (float32) mode on {len(session_dirs)} sessions...")
+    rows = []
+    for subj in session_dirs:
+        result = compare_modes(subj)
+        if result:
+            rows.append({"condition": subj.parent.name, "subject": subj.name, **result})
+
+    report = pd.DataFrame(rows)
+    report["peak_reduction"] = 1 - report["peak_mb_compact"] / report["peak_mb_float64"]
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+    print(f"\nMedian peak-memory reduction: {report['peak_reduction'].median():.1%}")
+    print(f"Output frames: {report['frame_mb_float64'].sum():.1f} MB -> {report['frame_mb_compact'].sum():.1f} MB")
+    print(f"Max grid difference (relative to channel range): {report['max_grid_diff'].max():.2e}")
+    print(f"Max relative session-feature difference: {report['max_feature_diff'].max():.2e}")
+    if not report["within_tolerance"].all():
+        bad = report.loc[~report["within_tolerance"], ["condition", "subject"]].values.tolist()
+        raise ValueError(f"Compact mode exceeded tolerance for sessions: {bad}")
+    print("\n✅ Compact mode matches the float64 path within tolerance.")
+
+
+if __name__ == "__main__":
+    main()
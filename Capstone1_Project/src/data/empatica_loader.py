@@ -3,6 +3,9 @@ from datetime import datetime
 import numpy as np
 import pandas as pd
 
+# IBI headers further than this from the session start are treated as corrupt
+IBI_HEADER_TOL_S = 60.0
+
 def _first_token(line: str) -> str:
     # Handle lines like "2013-06-12 16:18:58,2013-06-12 16:18:58,2013-06-12 16:18:58"
     return line.split(",")[0].strip()
@@ -24,14 +27,85 @@ def _parse_start_time(token: str) -> float:
             dt = dt.tz_localize(None)
         return dt.timestamp()
 
-def load_empatica(csv_path: str | Path) -> pd.DataFrame:
+def _load_ibi(p: Path, compact: bool, reference_start: float | None) -> pd.DataFrame:
+    """
+    IBI.csv: header row "<start>, IBI", then "<t>, <ibi>" rows (seconds).
+    Some exports restart with another header row part-way through
+    (STRESS/S02), so every header starts a new segment with its own start
+    time. S02 also repeats overlapping chunks of beats; exact repeats are
+    dropped and beats are returned in time order. Empty exports
+    (ANAEROBIC/S01) give an empty frame.
+
+    With reference_start (the session start of the other E4 files), a
+    segment header more than IBI_HEADER_TOL_S away from it cannot be trusted.
+    The longest such segment is re-anchored to reference_start, the others
+    are dropped: anchoring several segments to the same start would stack
+    their beats on top of each other. attrs["anchored"] / attrs["dropped_beats"]
+    / attrs["repeated_beats"] record what happened.
+    """
+    columns = ["t", "ibi", "timestamp"] + ([] if compact else ["start_time_utc"])
+    if p.stat().st_size == 0:
+        df = pd.DataFrame({c: np.array([], dtype=float) for c in columns})
+        df.attrs = {"start_time_utc": np.nan, "anchored": False, "dropped_beats": 0, "repeated_beats": 0}
+        return df
+
+    raw = pd.read_csv(p, header=None, usecols=[0, 1], names=["t", "ibi"], dtype=str, skipinitialspace=True)
+    ibi = pd.to_numeric(raw["ibi"], errors="coerce")
+    is_header = ibi.isna().to_numpy()
+    if not is_header[0]:
+        raise ValueError(f"Unexpected IBI format in {p}")
+    segment = np.cumsum(is_header) - 1
+    starts = np.array([_parse_start_time(_first_token(tok)) for tok in raw["t"][is_header]])
+
+    beats = ~is_header
+    sizes = np.bincount(segment[beats], minlength=len(starts))
+    keep = np.ones(len(starts), dtype=bool)
+    anchored = False
+    if reference_start is not None:
+        implausible = np.abs(starts - reference_start) > IBI_HEADER_TOL_S
+        if implausible.any():
+            anchor = np.flatnonzero(implausible)[np.argmax(sizes[implausible])]
+            starts[anchor] = reference_start
+            keep &= ~implausible
+            keep[anchor] = True
+            anchored = True
+    rows = beats & keep[segment]
+
+    t = pd.to_numeric(raw["t"][rows]).to_numpy(dtype=float)
+    df = pd.DataFrame({
+        "t": t,
+        "ibi": ibi[rows].to_numpy(dtype=float),
+        "timestamp": starts[segment[rows]] + t,
+        "start_time_utc": starts[segment[rows]],
+    })
+    repeated = df.duplicated(["timestamp", "ibi"])
+    df = df[~repeated].sort_values("timestamp", kind="stable").reset_index(drop=True)
+    attrs = {
+        "start_time_utc": float(starts[keep][0]) if keep.any() else np.nan,
+        "anchored": anchored,
+        "dropped_beats": int(sizes[~keep].sum()),
+        "repeated_beats": int(repeated.sum()),
+    }
+    if compact:
+        df = df.drop(columns="start_time_utc").astype({"t": np.float32, "ibi": np.float32})
+    df.attrs = attrs
+    return df
+
+def load_empatica(csv_path: str | Path, compact: bool = False, reference_start: float | None = None) -> pd.DataFrame:
     """
     Robust loader for Empatica E4 CSVs in this dataset.
 
     ACC -> columns: x,y,z,timestamp,sample_rate_hz,start_time_utc
-    IBI -> columns: t,ibi,timestamp,start_time_utc   (no sample_rate_hz)
+    IBI -> columns: t,ibi,timestamp,start_time_utc   (no sample_rate_hz; see _load_ibi
+           for repeated headers and reference_start)
     TAGS-> columns: utc,timestamp
     Others (EDA/HR/TEMP/BVP) -> value,timestamp,sample_rate_hz,start_time_utc
+
+    compact=True stores the signal values as float32 and keeps the constant
+    start_time_utc / sample_rate_hz in df.attrs instead of per-row columns.
+    Regularly sampled files then get no timestamp column either: sample i is
+    at start_time_utc + i / sample_rate_hz. IBI keeps its (irregular) float64
+    timestamp column. TAGS is unaffected.
     """
     p = Path(csv_path)
     stem = p.stem.upper()
@@ -42,17 +116,7 @@ def load_empatica(csv_path: str | Path) -> pd.DataFrame:
 
     # IBI: first line = start time; no sample rate on line 2
     if stem == "IBI":
-        start = _parse_start_time(_first_token(first_line))
-        df = pd.read_csv(p, skiprows=1, header=None)
-        if df.shape[1] < 2:
-            raise ValueError(f"Unexpected IBI format in {p}")
-        df = df.iloc[:, :2]
-        df.columns = ["t", "ibi"]
-        df["t"] = pd.to_numeric(df["t"], errors="coerce")
-        df["ibi"] = pd.to_numeric(df["ibi"], errors="coerce")
-        df["timestamp"] = start + df["t"].astype(float)
-        df["start_time_utc"] = start
-        return df
+        return _load_ibi(p, compact, reference_start)
 
     # TAGS: one timestamp per line
     if stem == "TAGS":
@@ -79,7 +143,7 @@ def load_empatica(csv_path: str | Path) -> pd.DataFrame:
     except ValueError:
         fs = None
 
-    df = pd.read_csv(p, skiprows=2, header=None)
+    df = pd.read_csv(p, skiprows=2, header=None, dtype=np.float32 if compact else None)
     if stem == "ACC":
         if df.shape[1] < 3:
             raise ValueError(f"ACC expected 3 columns in {p}, got {df.shape[1]}")
@@ -89,6 +153,10 @@ def load_empatica(csv_path: str | Path) -> pd.DataFrame:
         df = df.iloc[:, :1]
         df.columns = ["value"]
 
+    if compact:
+        df.attrs = {"start_time_utc": start, "sample_rate_hz": fs if fs and fs > 0 else np.nan}
+        return df
+
     if fs and fs > 0:
         n = len(df)
         df["timestamp"] = start + (pd.RangeIndex(n) / fs)
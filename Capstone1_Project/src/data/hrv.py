@@ -0,0 +1,150 @@
+# src/data/hrv.py
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .empatica_loader import load_empatica
+
+
+WINDOW_S = 60
+NN50_S = 0.05
+# E4 beat times are quantised to 1/64 s; consecutive beats satisfy
+# t[i+1] - t[i] == ibi[i+1] exactly, anything else is a detection gap.
+CONTIGUOUS_TOL_S = 1e-3
+HRV_COLS = ["IBI_count", "IBI_mean", "HRV_sdnn", "HRV_rmssd", "HRV_pnn50"]
+
+
+class IbiBatch(NamedTuple):
+    """IBI for many sessions concatenated; session k owns rows offsets[k]:offsets[k + 1]."""
+    keys: List[Tuple[str, str]]
+    timestamp: np.ndarray
+    ibi: np.ndarray
+    offsets: np.ndarray
+
+
+def load_ibi_batch(
+    ibi_paths: Dict[Tuple[str, str], Path],
+    reference_starts: Dict[Tuple[str, str], float] = None,
+) -> IbiBatch:
+    """
+    Load IBI.csv for every (condition, subject) into one ragged batch (missing files -> 0 beats).
+
+    Beat times are on the same clock as the other E4 files read by
+    load_empatica. `reference_starts` (session start times) is used to spot
+    corrupt IBI headers, see empatica_loader._load_ibi.
+    """
+    reference_starts = reference_starts or {}
+    keys = list(ibi_paths)
+    timestamps, ibis = [], []
+    for key in keys:
+        path = ibi_paths[key]
+        if path is None or not path.exists():
+            timestamps.append(np.array([]))
+            ibis.append(np.array([]))
+            continue
+        df = load_empatica(path, reference_start=reference_starts.get(key))
+        if df.attrs["anchored"]:
+            print(f"[WARN] {key[0]}/{key[1]}: implausible IBI header, beats anchored to the session start")
+        if df.attrs["dropped_beats"]:
+            print(f"[WARN] {key[0]}/{key[1]}: dropped {df.attrs['dropped_beats']} IBI beats with an unrecoverable header")
+        if df.attrs["repeated_beats"]:
+            print(f"[INFO] {key[0]}/{key[1]}: ignored {df.attrs['repeated_beats']} repeated IBI beats")
+        timestamps.append(df["timestamp"].to_numpy(dtype=float))
+        ibis.append(df["ibi"].to_numpy(dtype=float))
+
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in ibis])
+    empty = [np.array([], dtype=float)]
+    batch = IbiBatch(keys, np.concatenate(empty + timestamps), np.concatenate(empty + ibis), offsets)
+    _check_sorted(batch)
+    return batch
+
+
+def _check_sorted(batch: IbiBatch):
+    """Beat times must strictly increase within each session, or beats would be counted twice."""
+    session = np.repeat(np.arange(len(batch.keys)), np.diff(batch.offsets))
+    bad = (np.diff(batch.timestamp) <= 0) & (session[1:] == session[:-1])
+    if bad.any():
+        sessions = sorted({batch.keys[k] for k in session[1:][bad]})
+        raise ValueError(f"IBI timestamps are not strictly increasing for sessions: {sessions}")
+
+
+def _successive_diffs(batch: IbiBatch, session: np.ndarray):
+    """Successive IBI differences, restricted to contiguous beats of the same session."""
+    diffs = np.diff(batch.ibi)
+    valid = np.abs(np.diff(batch.timestamp) - batch.ibi[1:]) <= CONTIGUOUS_TOL_S
+    valid &= session[1:] == session[:-1]
+    return diffs, valid
+
+
+def _reduce(group: np.ndarray, n_groups: int, ibi: np.ndarray, diff_group: np.ndarray, diffs: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Segment reductions for every group at once.
+
+    IBI_mean / HRV_sdnn / HRV_rmssd are in milliseconds, HRV_pnn50 is a fraction.
+    HRV_sdnn is the sample SD (ddof=1) of the IBI series.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = np.bincount(group, minlength=n_groups).astype(float)
+        mean = np.bincount(group, weights=ibi, minlength=n_groups) / count
+        centered = np.bincount(group, weights=(ibi - mean[group]) ** 2, minlength=n_groups)
+        sdnn = np.sqrt(np.where(count > 1, centered / (count - 1), np.nan))
+
+        n_diffs = np.bincount(diff_group, minlength=n_groups).astype(float)
+        rmssd = np.sqrt(np.bincount(diff_group, weights=diffs ** 2, minlength=n_groups) / n_diffs)
+        nn50 = np.bincount(diff_group, weights=(np.abs(diffs) > NN50_S).astype(float), minlength=n_groups)
+        pnn50 = nn50 / n_diffs
+
+    return {
+        "IBI_count": count,
+        "IBI_mean": mean * 1000,
+        "HRV_sdnn": sdnn * 1000,
+        "HRV_rmssd": rmssd * 1000,
+        "HRV_pnn50": pnn50,
+    }
+
+
+def hrv_per_session(batch: IbiBatch) -> pd.DataFrame:
+    """IBI_mean, HRV_sdnn, HRV_rmssd, HRV_pnn50 for every session in the batch."""
+    n_sessions = len(batch.keys)
+    session = np.repeat(np.arange(n_sessions), np.diff(batch.offsets))
+    diffs, valid = _successive_diffs(batch, session)
+
+    stats = _reduce(session, n_sessions, batch.ibi, session[1:][valid], diffs[valid])
+    df = pd.DataFrame(batch.keys, columns=["condition", "subject"])
+    for col in HRV_COLS:
+        df[col] = stats[col]
+    return df
+
+
+def hrv_per_window(batch: IbiBatch, window_s: int = WINDOW_S) -> pd.DataFrame:
+    """
+    The same features over fixed windows of `window_s` seconds.
+
+    Windows sit on the absolute epoch grid, so with the default 60 s they line
+    up with the top level of the aggregate pyramids (aggregates.py). Successive differences
+    only count when both beats fall in the same window.
+    """
+    n_sessions = len(batch.keys)
+    session = np.repeat(np.arange(n_sessions), np.diff(batch.offsets))
+    window = np.floor(batch.timestamp / window_s).astype(np.int64)
+
+    pairs = np.stack([session, window], axis=1)
+    uniq, group = np.unique(pairs, axis=0, return_inverse=True)
+    group = group.ravel()
+
+    diffs, valid = _successive_diffs(batch, session)
+    valid &= window[1:] == window[:-1]
+
+    stats = _reduce(group, len(uniq), batch.ibi, group[1:][valid], diffs[valid])
+    keys = np.array(batch.keys, dtype=object).reshape(-1, 2)
+    df = pd.DataFrame({
+        "condition": keys[uniq[:, 0], 0] if len(uniq) else [],
+        "subject": keys[uniq[:, 0], 1] if len(uniq) else [],
+        "window_start": uniq[:, 1].astype(float) * window_s,
+    })
+    for col in HRV_COLS:
+        df[col] = stats[col]
+    return df
@@ -0,0 +1,207 @@
+# src/profiling.py
+"""
+Stage-level profiling for the batch scripts (src/data/clean_signals.py, train.py).
+
+Enable it with an environment variable pointing at an output directory:
+
+    PIPELINE_PROFILE=reports/profile python -m src.data.clean_signals
+
+The timed pass records wall time, CPU time and the process-wide RSS
+high-water mark (`resource.getrusage`) at the end of each stage, which adds
+only a few microseconds per stage. That mark never goes down, so it is not a
+per-stage peak; `process_rss_growth_mb` shows how much a stage raised it.
+Two heavier extras are opt-in and kept out of the timed numbers where
+possible:
+
+- PIPELINE_PROFILE_MEMORY=1 also traces Python allocations with tracemalloc
+  to get a real per-stage peak (`traced_peak_mb`). tracemalloc slows allocation-heavy stages a lot,
+  so wall/CPU times from such a run include its overhead.
+- PIPELINE_PROFILE_TOP=N (default 3) re-runs the N slowest sessions under
+  cProfile after the timed pass. Those .prof dumps include cProfile's own
+  overhead, but the timed numbers do not.
+
+When PIPELINE_PROFILE is unset every hook returns a shared no-op context manager.
+"""
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+_NOOP = nullcontext()
+
+
+def _max_rss_mb() -> float:
+    """Peak resident set size of this process so far in MB (NaN where unavailable)."""
+    if resource is None:
+        return np.nan
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB on Linux.
+    return rss / 1e6 if sys.platform == "darwin" else rss * 1024 / 1e6
+
+
+class Profiler:
+    def __init__(self, out_dir: Optional[Path] = None, capture_slowest: int = 3, trace_memory: bool = False):
+        self.enabled = out_dir is not None
+        self.out_dir = Path(out_dir) if out_dir is not None else None
+        self.capture_slowest = capture_slowest
+        self.trace_memory = trace_memory
+        self.events: List[Dict] = []
+        self._stack: List[Dict] = []
+        self._session_wall: Dict[str, float] = {}
+        self._profiles: List = []
+        self._t0 = time.perf_counter()
+
+    def stage(self, name: str, session: str = None):
+        """Context manager timing one pipeline stage (no-op when disabled)."""
+        if not self.enabled:
+            return _NOOP
+        return self._stage(name, session)
+
+    def session(self, name: str):
+        """Context manager timing one whole session (no-op when disabled)."""
+        if not self.enabled:
+            return _NOOP
+        return self._stage("session", session=name)
+
+    @contextmanager
+    def _stage(self, name: str, session: str = None):
+        if session is None and self._stack:
+            session = self._stack[-1]["session"]
+        frame = {"session": session, "peak": 0}
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self._stack:
+                parent = self._stack[-1]
+                parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        self._stack.append(frame)
+        rss_start = _max_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            rss_end = _max_rss_mb()
+            self._stack.pop()
+            event = {
+                "stage": name,
+                "session": session,
+                "start_s": wall_start - self._t0,
+                "wall_s": wall,
+                "cpu_s": cpu,
+                "process_max_rss_mb": rss_end,
+                "process_rss_growth_mb": rss_end - rss_start,
+                "tid": threading.get_ident(),
+            }
+            if self.trace_memory:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+                event["traced_peak_mb"] = peak / 1e6
+            if name == "session":
+                self._session_wall[session] = wall
+            self.events.append(event)
+
+    def profile_slowest(self, run_session: Callable[[str], None]):
+        """
+        Re-run the slowest sessions of the timed pass under cProfile.
+
+        `run_session(name)` must redo the work of one session; it should not
+        report back into this profiler or overwrite the outputs of the timed
+        pass (write to a temporary directory instead).
+        """
+        if not self.enabled or self.capture_slowest <= 0 or not self._session_wall:
+            return
+        slowest = sorted(self._session_wall, key=self._session_wall.get, reverse=True)[: self.capture_slowest]
+        print(f"Re-running {len(slowest)} slowest sessions under cProfile...")
+        for session in slowest:
+            profile = cProfile.Profile()
+            profile.runcall(run_session, session)
+            self._profiles.append((session, profile))
+
+    def summary(self) -> pd.DataFrame:
+        """Per-stage totals: calls, wall/CPU time and process/traced memory high-water marks."""
+        df = pd.DataFrame(self.events)
+        if df.empty:
+            return df
+        aggs = {
+            "calls": ("wall_s", "size"),
+            "wall_total_s": ("wall_s", "sum"),
+            "wall_max_s": ("wall_s", "max"),
+            "cpu_total_s": ("cpu_s", "sum"),
+            "process_rss_growth_mb": ("process_rss_growth_mb", "sum"),
+            "process_max_rss_mb": ("process_max_rss_mb", "max"),
+        }
+        if "traced_peak_mb" in df.columns:
+            aggs["traced_peak_mb_max"] = ("traced_peak_mb", "max")
+        summary = df.groupby("stage").agg(**aggs)
+        return summary.sort_values("wall_total_s", ascending=False)
+
+    def chrome_trace(self) -> Dict:
+        """Events in Chrome trace format (open in chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        trace = []
+        for event in self.events:
+            args = {k: event[k] for k in ("session", "cpu_s", "process_max_rss_mb", "process_rss_growth_mb", "traced_peak_mb") if k in event}
+            trace.append({
+                "name": event["stage"],
+                "cat": "pipeline",
+                "ph": "X",
+                "ts": event["start_s"] * 1e6,
+                "dur": event["wall_s"] * 1e6,
+                "pid": pid,
+                "tid": event["tid"],
+                "args": args,
+            })
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write_report(self, name: str):
+        """Write <name>_trace.json, <name>_stages.csv, <name>_summary.csv and slow-session dumps."""
+        if not self.enabled:
+            return
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(self.out_dir / f"{name}_trace.json", "w") as f:
+            json.dump(self.chrome_trace(), f)
+        pd.DataFrame(self.events).to_csv(self.out_dir / f"{name}_stages.csv", index=False)
+        summary = self.summary()
+        summary.to_csv(self.out_dir / f"{name}_summary.csv")
+
+        for session, profile in self._profiles:
+            profile.dump_stats(self.out_dir / f"{name}_{session}.prof")
+
+        print("\nProfile summary:")
+        if self.trace_memory:
+            print("(PIPELINE_PROFILE_MEMORY is on: wall/CPU times include tracemalloc overhead)")
+        print(summary.to_string(float_format=lambda x: f"{x:.3f}"))
+        print(f"\n📊 Saved profiling report to: {self.out_dir}")
+
+
+def from_env() -> Profiler:
+    """Profiler configured from PIPELINE_PROFILE / _TOP / _MEMORY (disabled if PIPELINE_PROFILE is unset)."""
+    out_dir = os.environ.get("PIPELINE_PROFILE")
+    capture_slowest = int(os.environ.get("PIPELINE_PROFILE_TOP", "3"))
+    trace_memory = os.environ.get("PIPELINE_PROFILE_MEMORY", "").lower() in ("1", "true", "yes")
+    return Profiler(Path(out_dir) if out_dir else None, capture_slowest=capture_slowest, trace_memory=trace_memory)
@@ -7,6 +7,8 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 from xgboost import XGBClassifier
 
+from src import profiling
+
 
 def load_features(features_path: Path) -> pd.DataFrame:
     if not features_path.exists():
@@ -43,10 +45,11 @@ def build_X_y(df: pd.DataFrame):
     return X, y, feature_cols, label_map
 
 
-def train_xgboost(X, y, random_state: int = 42):
+def train_xgboost(X, y, random_state: int = 42, profiler: profiling.Profiler = None):
     """
     Train an XGBoost multi-class classifier with the same settings as in the notebook.
     """
+    profiler = profiler or profiling.Profiler()
     X_train, X_test, y_train, y_test = train_test_split(
         X,
         y,
@@ -67,10 +70,12 @@ def train_xgboost(X, y, random_state: int = 42):
         random_state=random_state,
     )
 
-    model.fit(X_train, y_train)
+    with profiler.stage("xgboost_fit"):
+        model.fit(X_train, y_train)
 
-    y_pred = model.predict(X_test)
-    acc = accuracy_score(y_test, y_pred)
+    with profiler.stage("evaluate"):
+        y_pred = model.predict(X_test)
+        acc = accuracy_score(y_test, y_pred)
 
     print(f"\nXGBoost test accuracy: {acc:.4f}\n")
     print("Classification report:")
@@ -91,14 +96,18 @@ def main():
     models_dir = project_root / "models"
     models_dir.mkdir(parents=True, exist_ok=True)
 
+    profiler = profiling.from_env()
+
     print(f"Loading features from: {features_path}")
-    df = load_features(features_path)
+    with profiler.stage("load_features"):
+        df = load_features(features_path)
 
     print("Building X and y...")
-    X, y, feature_cols, label_map = build_X_y(df)
+    with profiler.stage("build_X_y"):
+        X, y, feature_cols, label_map = build_X_y(df)
 
     print("Training XGBoost model...")
-    model = train_xgboost(X, y, random_state=42)
+    model = train_xgboost(X, y, random_state=42, profiler=profiler)
 
     artifact = {
         "model": model,
@@ -107,9 +116,11 @@ def main():
     }
 
     out_path = models_dir / "xgb_stress_exercise.joblib"
-    joblib.dump(artifact, out_path)
+    with profiler.stage("save_artifact"):
+        joblib.dump(artifact, out_path)
     print(f"\n✅ Saved model artifact to: {out_path}")
     print("  - Contains: XGBoost model, feature column list, label mapping.")
+    profiler.write_report("train")
 
 
 if __name__ == "__main__":